@@ -32,12 +32,23 @@ from kivy.clock import Clock
 import os
 import re
 import sys
+import heapq
+import pickle
+import hashlib
 import csv
-import numpy as np
+import operator
+from concurrent.futures import ThreadPoolExecutor
+# pyahocorasick is optional, it speeds up matching the plain text regexes of config files
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 ## Importing matplotlib causes problems if done here.
 ## We will put the import for matplotlib in the body
 ## of the graphing functions, as this does not seem to 
 ## cause problems.
+## numpy is imported the same way, in the body of the
+## functions that use it, so it is only loaded once needed.
 
 PROJ_DIR = # TODO put the project directory here
 
@@ -47,15 +58,26 @@ class AccountExpenseHistory:
 
     Parses monthly account data and represents it with two fields:
         self.dates    : a list of strings giving the year and month in yyyy_mm format
-        self.expenses : a list of lists of expenses, each index of self.expenses matches
-                        the date in self.dates and contains a list of expenses for that
-                        month as tuples (string: location, float: expense amount)
+        self.expenses : a list of the monthly expenses, each index of self.expenses matches
+                        the date in self.dates and contains the expenses for that month
+                        as a pair of numpy arrays (float: expense amounts, string: locations)
+
+    The monthly data files are listed in two more fields:
+        self.files      : a list of the names of the data files, sorted chronologically
+        self.file_paths : a list of the full paths of those files, in the same order
 
     NOTE: parse_and_aggregate_expenses and check_exclusion are meant to be overridden by 
-          any subclass
+          any subclass. The working directory is not changed to the data directory, so 
+          overrides must open the files through self.file_paths, not the bare names in 
+          self.files.
     """
     
-    p = re.compile("[1-9]+[0-9]*")
+    # Matches a whole file name holding exactly two numbers, the year (group y) followed
+    # by the month (group m). Leading zeros are not part of either number.
+    p = re.compile(r"[\D0]*(?P<y>[1-9]\d*)\D[\D0]*(?P<m>[1-9]\d*)(?:\D[\D0]*)?")
+
+    # translation table for str.translate that deletes commas
+    remove_commas = str.maketrans("", "", ",")
     
     def __init__(self, *, data_path, label):
         """" 
@@ -70,6 +92,7 @@ class AccountExpenseHistory:
         self.path = data_path
 
         self.files = self.extract_files()
+        self.file_paths = [os.path.join(self.path, file) for file in self.files]
         self.is_missing_data = self.audit_for_missing_data()
         self.dates = self.extract_dates()
         self.expenses = self.parse_and_aggregate_expenses()
@@ -82,78 +105,77 @@ class AccountExpenseHistory:
 
         dates = []
         for file in self.files:
-            y,m = map(int, self.p.findall(file))
-            date_str = "{}_{:02d}".format(y,m)
+            mo = self.p.fullmatch(file)
+            date_str = "{}_{:02d}".format(int(mo["y"]), int(mo["m"]))
             dates.append(date_str)
         return dates
 
 
     def extract_files(self):
         """
-        Gets the names of the files from the data directory, skipping . files
+        Gets the names of the files from the data directory, skipping . files and directories
         """
 
-        os.chdir(self.path)
         data_files = []
-        files = os.listdir()
-        for file in files:
-            if not file.startswith("."):
-                data_files.append(file) 
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith("."):
+                    data_files.append(entry.name) 
         data_files.sort()
         return data_files
         
 
     def parse_and_aggregate_expenses(self):
         """
-        Creates the list of lists for self.expenses
+        Creates the list of monthly expenses for self.expenses
 
-        Reads the files in self.path and converts them to a list of lists. 
-        Each sublist contains a list of expenses for the corresponding month in self.dates. 
-        Where the expenses are represented as (float : expense, string location) tuples.
+        Reads the files in self.path and converts them to a list of (amounts, locations)
+        pairs of numpy arrays, one pair for each month in self.dates. amounts[k] is the 
+        float expense made at the string location locations[k].
 
-        ASSERTION: The program assumes that expenses are all non-negative.
+        ASSERTION: The program assumes that expenses are all non-negative. 
 
         For example:
             if self.dates[0] == "2023_03"
             then the return of this function (which will be stored as self.expenses) should
-            have a list of tuples representing expenses for March 2023 at index 0,
-            where the tuples are of the form (float: expense, string: location)
-            
+            have the pair (amounts, locations) for the expenses of March 2023 at index 0.
         """
 
+        import numpy as np
+
         date_idx     = 0
         expense_idx  = 1
         location_idx = 4
 
+        # Bound once here as they are used for every row of every file
+        check_exclusion = self.check_exclusion
+        reader = csv.reader
+        remove_commas = self.remove_commas
+        get_columns = operator.itemgetter(date_idx, expense_idx, location_idx)
+
         data = []
-        for file in self.files:
-            month = []
-            f = open(file, "r")
-            r = csv.reader(f)
-            for row in r:
-                if row == []:
-                    continue
-                date     = row[date_idx]
-                expense  = row[expense_idx]
-                location = row[location_idx]
-                location = location.upper()
-                
-                # get rid of commas
-                expense = re.sub(",", "", expense)
-                # expenses are negative so we convert
-                expense = -1 * float(expense)
-
-                is_excluded = self.check_exclusion(
-                                date=date,
-                                expense=expense,
-                                location=location)
-
-                if is_excluded:
-                    continue
-                else:
-                    month.append( (expense, location) )
+        for file in self.file_paths:
+            f = open(file, "r", newline="")
+            # the (date, expense, location) of each non empty row
+            rows = list(map(get_columns, filter(None, reader(f))))
             f.close()
-            data.append(month)
+
+            # Work on the file a column at a time
+            dates, expenses, locations = zip(*rows) if rows else ((), (), ())
+
+            # upper case every location with one map in C (numpy's fixed width strings 
+            # would cut off letters that grow when upper cased, like "ß" -> "SS")
+            locations = list(map(str.upper, locations))
+            # get rid of commas, expenses are negative so we convert
+            expenses = [-float(expense.translate(remove_commas)) for expense in expenses]
+
+            is_kept = [not check_exclusion(date=date, expense=expense, location=location)
+                       for date, expense, location in zip(dates, expenses, locations)]
+            is_kept = np.array(is_kept, dtype=bool)
+
+            amounts   = np.array(expenses, dtype=np.float64)[is_kept]
+            locations = np.array(locations, dtype=np.str_)[is_kept]
+            data.append( (amounts, locations) )
         return data
 
 
@@ -162,35 +184,23 @@ class AccountExpenseHistory:
         Checks self.files for missing data
         """
 
+        import numpy as np
+
         if self.files == []:
             return True 
-        file0 = self.files[0]
-        mo = self.p.findall(file0)
-        if (len(mo) != 2):
-            print("Error: files not formatted correctly in {}".format(self.path))
-            print("exiting...")
-            sys.exit(1)
-
-        # start year and month of data
-        y0,m0 = map(int, mo)
-        for file in self.files[1: ]:
-            mo = self.p.findall(file)
-            if (len(mo) != 2):
+
+        # Months since year 0 for each file, consecutive files must differ by one month
+        months = []
+        for file in self.files:
+            mo = self.p.fullmatch(file)
+            if mo is None:
                 print("Error: files not formatted correctly in {}".format(self.path))
                 print("Bad filename is {}".format(file))
                 print("exiting...")
                 sys.exit(1)
-            y,m = map(int, mo)
-            # update y0,m0 to the next month
-            if m0 == 12:
-                m0 = 1
-                y0 += 1
-            else:
-                m0 += 1
-            # check that y,m matches the next month
-            if (y != y0 or m != m0):
-                return True
-        return False
+            months.append(12 * int(mo["y"]) + int(mo["m"]))
+        months = np.array(months, dtype=np.int32)
+        return not np.all(np.diff(months) == 1)
 
 
     def check_exclusion(self, *, date, expense, location):
@@ -237,6 +247,9 @@ class ExpenseHistoryAnalyzer:
     if (os.path.exists(output_path_regex_collisions)):
         os.remove(output_path_regex_collisions)
 
+    # characters that make a regex in the config file more than plain text
+    regex_metacharacters = set(".^$*+?{}[]\\|()")
+
     def __init__(self, *, config_path, label, target_total_limit, intersect_account_dates = True, **accounts):
         """
         Sets the parameters for the analysis of one of more accounts
@@ -264,9 +277,12 @@ class ExpenseHistoryAnalyzer:
         self.target_total_limit = target_total_limit
         self.accounts = accounts 
 
-        cats, cat_limits = self.read_config()
+        cats, cat_limits, combined_regex, literal_automaton, fallback_regex_idxs = self.read_config()
         self.regex_category_dict = cats
         self.category_limits = cat_limits
+        self.combined_regex = combined_regex
+        self.literal_automaton = literal_automaton
+        self.fallback_regex_idxs = fallback_regex_idxs
 
         # Add the user defined cateogires 
         self.categories = list(cats.values())
@@ -282,15 +298,136 @@ class ExpenseHistoryAnalyzer:
         # initialize and setup output files for logging
         self.output_path_uncategorized = PROJ_DIR + os.path.sep + "Uncategorized Locations" + os.path.sep + self.label + "_uncategorized_locations.txt"
 
-        f = open(self.output_path_uncategorized, "w")
-        f.write("Using config file: {}\n".format(self.config_path))
-        f.close()
+        # Locations repeat a lot across months and accounts, so the category of each
+        # location is only worked out once. key: string location value: string category
+        self.location_cache = {}
+
+        # Lines this analyzer wrote to output_path_regex_collisions
+        self.collision_log = []
+
+        # The categorized data is saved to disk and reused for as long as the config
+        # file and the data files of the accounts are unchanged
+        self.cache_path = self.find_cache_path(intersect_account_dates)
+        is_cached = False
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            is_cached = self.load_cache()
+        if not is_cached:
+            f = open(self.output_path_uncategorized, "w")
+            f.write("Using config file: {}\n".format(self.config_path))
+            f.close()
+
+            data = {}
+            for account in accounts.values():
+                d = self.categorize_history(account) 
+                data[account.label] = d
+            self.data = data
+
+            if self.cache_path is not None:
+                self.save_cache()
+
 
-        data = {}
-        for account in accounts.values():
-            d = self.categorize_history(account) 
-            data[account.label] = d
+    def find_cache_path(self, intersect_account_dates):
+        """
+        Gets the path of the file used to cache self.data
+
+        The file name is <label>_<analyzer hash>_<data hash>.pkl. The analyzer hash tells
+        apart analyzers that share a label: it covers this source file, the config file
+        and the names, labels, classes and data directories of the accounts (by path) and
+        intersect_account_dates. The data hash covers everything the categorized data 
+        depends on: the config file, the data files of every account, this source file and
+        the source files defining the classes of the accounts (their sizes and modification
+        times), as well as everything in the analyzer hash.
+
+        Returns None if an account does not list its data files in a file_paths field,
+        or its class was not loaded from a file, as then there is no way to tell when 
+        its data changes.
+        """
+
+        def file_stamp(path):
+            stat = os.stat(path)
+            return (path, stat.st_mtime_ns, stat.st_size)
+
+        # This file holds the code that categorizes the data, so editing it starts afresh
+        source_file = os.path.abspath(__file__)
+        config_file = os.path.abspath(os.path.join(self.config_path, "config.txt"))
+        identity = [source_file, config_file, intersect_account_dates]
+        key = [file_stamp(config_file), file_stamp(source_file)]
+        for name, account in self.accounts.items():
+            file_paths = getattr(account, "file_paths", None)
+            # the file defining the account's class holds the code that parsed its data
+            module = sys.modules.get(type(account).__module__)
+            module_file = getattr(module, "__file__", None)
+            if file_paths is None or module_file is None or not os.path.isfile(module_file):
+                return None
+            identity.append((name, 
+                             account.label, 
+                             type(account).__qualname__,
+                             os.path.abspath(getattr(account, "path", ""))))
+            key.append((file_stamp(os.path.abspath(module_file)),
+                        [file_stamp(path) for path in file_paths]))
+        analyzer_digest = hashlib.sha256(repr(identity).encode()).hexdigest()[ :16]
+        data_digest = hashlib.sha256(repr((identity, key)).encode()).hexdigest()
+
+        return os.path.join(PROJ_DIR, ".cache", 
+                            "{}_{}_{}.pkl".format(self.label, analyzer_digest, data_digest))
+
+
+    def load_cache(self):
+        """
+        Sets self.data from self.cache_path and restores the logs written when it was made
+
+        Returns True if the cache was loaded, False if it could not be read (for example a 
+        truncated file or one pickled by an incompatible version of numpy), in which case
+        the data has to be categorized again.
+        """
+
+        try:
+            with open(self.cache_path, "rb") as f:
+                cached = pickle.load(f)
+            data = cached["data"]
+            collision_log = cached["collisions"]
+            uncategorized = cached["uncategorized"]
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, IndexError,
+                AttributeError, ImportError, ValueError, TypeError):
+            return False
         self.data = data
+        self.collision_log = collision_log
+
+        with open(self.output_path_uncategorized, "w") as out:
+            out.write(uncategorized)
+        if self.collision_log != []:
+            with open(self.output_path_regex_collisions, "a") as out:
+                out.write("".join(self.collision_log))
+        return True
+
+
+    def save_cache(self):
+        """
+        Saves self.data and the logs written while making it to self.cache_path
+        """
+
+        with open(self.output_path_uncategorized, "r") as f:
+            uncategorized = f.read()
+        cached = {"data"          : self.data,
+                  "collisions"    : self.collision_log,
+                  "uncategorized" : uncategorized}
+
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        # write to a temporary file first so an interrupted write leaves no broken cache
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(cached, f)
+        os.replace(tmp_path, self.cache_path)
+
+        # Remove the caches this analyzer made from older data, config or code, the
+        # analyzer hash keeps the caches of other analyzers with the same label
+        cache_dir, cache_name = os.path.split(self.cache_path)
+        analyzer_prefix = cache_name[ :len(self.label) + 1 + 16]
+        old_cache = re.compile(re.escape(analyzer_prefix) + r"_[0-9a-f]{64}\.pkl")
+        with os.scandir(cache_dir) as entries:
+            for entry in entries:
+                if entry.name != cache_name and old_cache.fullmatch(entry.name):
+                    os.remove(entry.path)
 
 
     def find_date_range_intersection(self):
@@ -299,15 +436,26 @@ class ExpenseHistoryAnalyzer:
 
         Returns the dates as a sorted list.
         
-        ASSERTION: Sorting the date list will put them in chronological order
+        ASSERTION: The dates field of every account is sorted in chronological order
         """
         accounts = iter(self.accounts.values())
         account = next(accounts)
-        date_range = set(account.dates)
+        date_range = list(account.dates)
         for account in accounts:
-            date_range = date_range.intersection(set(account.dates))
-        date_range = list(date_range)
-        date_range.sort()
+            # walk both sorted lists together keeping the dates they share
+            common = []
+            i = 0
+            j = 0
+            while i < len(date_range) and j < len(account.dates):
+                if date_range[i] == account.dates[j]:
+                    common.append(date_range[i])
+                    i += 1
+                    j += 1
+                elif date_range[i] < account.dates[j]:
+                    i += 1
+                else:
+                    j += 1
+            date_range = common
         
         return date_range
 
@@ -318,14 +466,15 @@ class ExpenseHistoryAnalyzer:
 
         Returns the dates as a sorted list
 
-        ASSERTION: Sorting the date list will put them in chronological order
+        ASSERTION: The dates field of every account is sorted in chronological order
         """
 
-        date_range = set()
-        for account in self.accounts.values():
-            date_range = date_range.union(set(account.dates))
-        date_range = list(date_range)
-        date_range.sort()
+        date_range = []
+        all_dates = heapq.merge(*(account.dates for account in self.accounts.values()))
+        for date in all_dates:
+            # merged dates are in order so repeats are adjacent
+            if date_range == [] or date_range[-1] != date:
+                date_range.append(date)
         return date_range
 
 
@@ -348,26 +497,31 @@ class ExpenseHistoryAnalyzer:
         """
 
         from matplotlib import pyplot as plt
+        import numpy as np
         plt.style.use('tableau-colorblind10')
 
-        bottom = np.zeros(len(self.dates))
         fig, ax = plt.subplots()
+        # Bars go at integer positions, the dates are only set once as the tick labels
+        x = np.arange(len(self.dates))
 
         slice = {}
-        for account in self.data.keys():
+        for account in self.data:
             slice[account]= self.data[account][category]
 
-
-        for account, values in slice.items():
-            p = ax.bar(self.dates, values, label = account,
+        # each account is stacked on the sum of the accounts before it
+        values = np.array(list(slice.values()))
+        bottoms = np.zeros_like(values)
+        bottoms[1: ] = np.cumsum(values, axis=0)[ :-1]
+        for account, v, bottom in zip(slice, values, bottoms):
+            p = ax.bar(x, v, label = account,
                    bottom = bottom)
-            bottom += values
 
-        if category in self.category_limits.keys():
+        if category in self.category_limits:
             ax.axhline(y=self.category_limits[category], color="red")
         
-        plt.xticks(rotation=75)
-        if len(self.data.keys()) > 1:
+        ax.set_xticks(x)
+        ax.set_xticklabels(self.dates, rotation=75)
+        if len(self.data) > 1:
             ax.legend(loc="upper right")
         plt.show()
 
@@ -378,30 +532,31 @@ class ExpenseHistoryAnalyzer:
         """
 
         from matplotlib import pyplot as plt
+        import numpy as np
         plt.style.use('tableau-colorblind10')
-        bottom = np.zeros(len(self.dates))
         fig, ax = plt.subplots()
-
-        slice = {}
-        for category in categories:
-            for account in self.data.keys():
-                if (category not in slice.keys()):
-                    slice[category] = self.data[account][category]
-                else:
-                    slice[category] = np.add(slice[category],self.data[account][category])
-
-        for category, values in slice.items():
-            p = ax.bar(self.dates, values, label = category,
+        # Bars go at integer positions, the dates are only set once as the tick labels
+        x = np.arange(len(self.dates))
+
+        # Sum each category over the accounts in one call on an 
+        # (accounts x categories x dates) array
+        stacked = np.array([[self.data[account][category] for category in categories]
+                            for account in self.data])
+        slice = dict(zip(categories, stacked.sum(axis=0)))
+
+        # each category is stacked on the sum of the categories before it
+        values = np.array(list(slice.values()))
+        bottoms = np.zeros_like(values)
+        bottoms[1: ] = np.cumsum(values, axis=0)[ :-1]
+        for category, v, bottom in zip(slice, values, bottoms):
+            p = ax.bar(x, v, label = category,
                    bottom = bottom)
-            bottom += values
 
-        total_limit = 0
-        for category in slice.keys():
-            if category in self.category_limits.keys():
-                total_limit += self.category_limits[category]
+        total_limit = sum(self.category_limits.get(category, 0) for category in slice)
         ax.axhline(y=total_limit, color="red")
         
-        plt.xticks(rotation=75)
+        ax.set_xticks(x)
+        ax.set_xticklabels(self.dates, rotation=75)
         if len(categories) > 1:
             ax.legend(loc="upper right")
         plt.show()       
@@ -413,38 +568,36 @@ class ExpenseHistoryAnalyzer:
         """
 
         from matplotlib import pyplot as plt
+        import numpy as np
         plt.style.use('tableau-colorblind10')
-        bottom = np.zeros(len(self.dates))
         fig, ax = plt.subplots()
+        # Bars go at integer positions, the dates are only set once as the tick labels
+        x = np.arange(len(self.dates))
 
-        totals = np.zeros(len(self.dates))
-        for account in self.data.keys():
-            totals = np.add(totals, self.data[account]["Total"])
+        totals = np.array([self.data[account]["Total"] for account in self.data]).sum(axis=0)
 
-        slice = {}
-        for category in categories:
-            for account in self.data.keys():
-                if (category not in slice.keys()):
-                    slice[category] = self.data[account][category]
-                else:
-                    slice[category] = np.add(slice[category],self.data[account][category])
+        # Sum each category over the accounts in one call on an 
+        # (accounts x categories x dates) array
+        stacked = np.array([[self.data[account][category] for category in categories]
+                            for account in self.data])
+        slice = dict(zip(categories, stacked.sum(axis=0)))
 
         # plot totals first
-        p = ax.bar(self.dates, totals, label="Total")
-
-        # Plot other categories
-        for category, values in slice.items():
-            p = ax.bar(self.dates, values, label = category,
+        p = ax.bar(x, totals, label="Total")
+
+        # Plot other categories, each stacked on the sum of the categories before it
+        values = np.array(list(slice.values()))
+        bottoms = np.zeros_like(values)
+        bottoms[1: ] = np.cumsum(values, axis=0)[ :-1]
+        for category, v, bottom in zip(slice, values, bottoms):
+            p = ax.bar(x, v, label = category,
                    bottom = bottom)
-            bottom += values
 
-        total_limit = 0
-        for category in slice.keys():
-            if category in self.category_limits.keys():
-                total_limit += self.category_limits[category]
+        total_limit = sum(self.category_limits.get(category, 0) for category in slice)
         ax.axhline(y=total_limit, color="red")
         
-        plt.xticks(rotation=75)
+        ax.set_xticks(x)
+        ax.set_xticklabels(self.dates, rotation=75)
         ax.legend(loc="upper right")
         plt.show()       
 
@@ -456,54 +609,126 @@ class ExpenseHistoryAnalyzer:
         If a location matches more than one category the first match will be used and
         the problematic location and configuration file will be written to 
         output_path_regex_collisions so that the user can modify the corresponding 
-        config.txt file
+        config.txt file. Each location is only categorized (and checked for collisions)
+        the first time it is seen by the analyzer, after that self.location_cache is used.
+
+        Returns a dictionary key: string category 
+                             value: numpy array of the monthly expenses for the category,
+                                    index k is the month given by self.dates[k]
         """
 
-        category_expenses = {}
-        for category in self.categories: 
-            category_expenses[category] = [0] * len(self.dates)
+        import numpy as np
+
+        # position of each category in the accumulation below
+        category_idx = {category: k for k, category in enumerate(self.categories)}
+
+        # One array per month with an entry per expense, the monthly sums are computed 
+        # once all are collected
+        amounts   = [np.zeros(0, dtype=np.float64)]
+        date_idxs = [np.zeros(0, dtype=np.int32)]
+        cat_idxs  = [np.zeros(0, dtype=np.int32)]
         
-        path = account.path
-        os.chdir(path)
         uncategorized_locations = set()
-        date_set = set(self.dates)
-        data_idx = 0
+        collision_lines = []
+        date_to_idx = {date: k for k, date in enumerate(self.dates)}
+        regex_category_pairs = list(self.regex_category_dict.items())
+        # regexes that are searched for, rather than found by the automaton
+        is_searched = [("g{}".format(i) in self.combined_regex.groupindex 
+                        or i in self.fallback_regex_idxs)
+                       for i in range(len(regex_category_pairs))]
         for a_idx in range(len(account.dates)):
-            date = account.dates[a_idx]
-            if date not in date_set:
+            data_idx = date_to_idx.get(account.dates[a_idx])
+            if data_idx is None:
                 continue
-            else:
-                while (self.dates[data_idx] != date):
-                    data_idx += 1
-            month_data = account.expenses[a_idx]
-            for expense,location in month_data:
-                cats = []
-                cat = None
-                for regex in self.regex_category_dict.keys():
-                    if regex.search(location):
-                        cats.append(self.regex_category_dict[regex])
-                if len(cats) > 1:
-                    with open(self.output_path_regex_collisions, "a") as out:
-                        out.write("Collision in {}\n".format(self.config_path))
-                        out.write("Location: {} matches the following categories:\n".format(location))
-                        for c in cats:
-                            out.write(c + "\n")
-                        out.write("\n")
-                        
-
-                if cats == []:
-                    cat = "Misc"
+            month = account.expenses[a_idx]
+            if not (isinstance(month, tuple) and len(month) == 2
+                    and isinstance(month[0], np.ndarray) and isinstance(month[1], np.ndarray)
+                    and len(month[0]) == len(month[1])):
+                print("Error: the expenses of account {} for {} are not an".format(account.label, account.dates[a_idx]))
+                print("       (amounts, locations) pair of numpy arrays of the same length.")
+                print("       {}.parse_and_aggregate_expenses must return one such pair".format(type(account).__name__))
+                print("       for every month (see the README).")
+                print("exiting...")
+                sys.exit(1)
+            month_amounts, month_locations = month
+
+            # Categorize each distinct location of the month once, then spread the
+            # categories back over the expenses
+            locations, inverse = np.unique(month_locations, return_inverse=True)
+            location_cat_idxs = np.zeros(len(locations), dtype=np.int32)
+            for l_idx, location in enumerate(locations.tolist()):
+                cat = self.location_cache.get(location)
+                if cat is None:
+                    # positions of the regexes known to match the location
+                    hits = set()
+                    if self.literal_automaton is not None:
+                        for end, idxs in self.literal_automaton.iter(location):
+                            hits.update(idxs)
+                    m = self.combined_regex.match(location)
+                    if m is not None:
+                        # group g<i> belongs to the i-th regex of the config file
+                        hits.add(int(m.lastgroup[1:]))
+                    for i in self.fallback_regex_idxs:
+                        if regex_category_pairs[i][0].search(location):
+                            hits.add(i)
+                            break
+
+                    if hits == set():
+                        cat = "Misc"
+                    else:
+                        first = min(hits)
+                        cat = regex_category_pairs[first][1]
+
+                        # Only the regexes after the first match can collide with it,
+                        # the automaton has already found every plain text match
+                        cats = [cat]
+                        for i in range(first+1, len(regex_category_pairs)):
+                            regex, c = regex_category_pairs[i]
+                            if i in hits or (is_searched[i] and regex.search(location)):
+                                cats.append(c)
+                        if len(cats) > 1:
+                            collision_lines.append("Collision in {}\n".format(self.config_path))
+                            collision_lines.append("Location: {} matches the following categories:\n".format(location))
+                            for c in cats:
+                                collision_lines.append(c + "\n")
+                            collision_lines.append("\n")
+                    self.location_cache[location] = cat
+
+                if cat == "Misc":
                     uncategorized_locations.add(location)
-                else:
-                    cat = cats[0]
 
-                category_expenses[cat][data_idx] += expense
-                category_expenses["Total"][data_idx] += expense
+                location_cat_idxs[l_idx] = category_idx[cat]
 
-        # Write the uncategorized locations before exiting
+            amounts.append(month_amounts)
+            date_idxs.append(np.full(len(month_amounts), data_idx, dtype=np.int32))
+            cat_idxs.append(location_cat_idxs[inverse])
+
+        amounts   = np.concatenate(amounts)
+        date_idxs = np.concatenate(date_idxs)
+        cat_idxs  = np.concatenate(cat_idxs)
+
+        # Sum every (category, month) cell in one pass, each expense is binned by the 
+        # flat index of its cell in a (categories x dates) table
+        n_cells = len(self.categories) * len(self.dates)
+        table = np.bincount(cat_idxs * len(self.dates) + date_idxs,
+                            weights = amounts,
+                          minlength = n_cells)
+        table = table.reshape(len(self.categories), len(self.dates))
+
+        category_expenses = {}
+        for category in self.categories:
+            category_expenses[category] = table[category_idx[category]]
+        # No expense is binned under Total, so its row is zero and the column sums 
+        # of the table are the monthly totals
+        category_expenses["Total"] = table.sum(axis=0)
+
+        # Write the collisions and uncategorized locations before exiting
+        if collision_lines != []:
+            with open(self.output_path_regex_collisions, "a") as out:
+                out.write("".join(collision_lines))
+            self.collision_log.extend(collision_lines)
         with open(self.output_path_uncategorized, "a") as out:
-            for location in uncategorized_locations:
-                out.write(location + "\n")
+            out.write("".join(location + "\n" for location in uncategorized_locations))
         return category_expenses
 
 
@@ -512,10 +737,22 @@ class ExpenseHistoryAnalyzer:
         Reads in the configuration file. 
 
         Returns:
-            limits_for_categories: dictionary key: string category 
-                                              value: float budget limit for that category
             regex_category_dict : dictionary key: re.Pattern regex 
                                            value: string category
+            limits_for_categories: dictionary key: string category 
+                                              value: float budget limit for that category
+            combined_regex : re.Pattern combining the regexes in regex_category_dict that
+                             are not in literal_automaton, the regex at position i is 
+                             captured by the group named g<i> and the first regex (in file
+                             order) to match a location is the one that is reported
+            literal_automaton : ahocorasick.Automaton finding the regexes that are only 
+                                plain text (or alternatives of plain text), the value of
+                                each word is a tuple of the positions of the regexes it 
+                                belongs to. None if pyahocorasick is not installed or no
+                                regex is plain text.
+            fallback_regex_idxs : list of the positions (in file order) of the regexes that
+                                  are in neither combined_regex nor literal_automaton, 
+                                  these have to be searched one at a time
 
         Note: When parsing the data files, locations that match a key in regex_category_dict
               will be counted towards the category given by regex_category_dict[key].
@@ -526,8 +763,7 @@ class ExpenseHistoryAnalyzer:
         category_idx = 0
         limit_idx    = 1
         regex_idx    = 2
-        os.chdir(self.config_path)
-        file = open("config.txt", "r")
+        file = open(os.path.join(self.config_path, "config.txt"), "r")
         lines = file.readlines()
         file.close()
         regex_category_dict= {}
@@ -557,8 +793,57 @@ class ExpenseHistoryAnalyzer:
                 limit = float(line[limit_idx])
                 limits_for_categories[category] = limit
         limits_for_categories["Total"] = self.target_total_limit 
+
+        # Regexes that are plain text, such as "COFFEE SHOP|CAFE", are found with an
+        # Aho-Corasick automaton when pyahocorasick is installed. It finds all of them
+        # in one pass over the location. key: string word value: list of regex positions
+        literal_words = {}
+        if ahocorasick is not None:
+            for i, regex in enumerate(regex_category_dict.keys()):
+                words = regex.pattern.split("|")
+                if all(word != "" and not (set(word) & self.regex_metacharacters) for word in words):
+                    for word in words:
+                        literal_words.setdefault(word, []).append(i)
+
+        literal_automaton = None
+        if literal_words != {}:
+            literal_automaton = ahocorasick.Automaton()
+            for word, idxs in literal_words.items():
+                literal_automaton.add_word(word, tuple(idxs))
+            literal_automaton.make_automaton()
+        literal_idxs = set(i for idxs in literal_words.values() for i in idxs)
+
+        # Combine the other regexes into one pattern so each location is scanned in a 
+        # single call. Every regex sits in a lookahead at the start of the location,
+        # so the alternatives are tried in file order and each may match anywhere.
+        # Wrapping a regex only leaves its meaning unchanged if it has no groups of its
+        # own (their numbers would shift and names could clash with g<i>) and no global 
+        # inline flags (which must start the whole pattern), those regexes are kept 
+        # aside and searched one at a time instead.
+        default_flags = re.compile("").flags
+        alternatives = []
+        fallback_regex_idxs = []
+        for i, regex in enumerate(regex_category_dict.keys()):
+            if i in literal_idxs:
+                continue
+            alternative = r"(?=[\s\S]*?(?P<g{}>{}))".format(i, regex.pattern)
+            is_combinable = (regex.groups == 0 and regex.flags == default_flags)
+            if is_combinable:
+                try:
+                    re.compile(alternative)
+                except re.error:
+                    is_combinable = False
+            if is_combinable:
+                alternatives.append(alternative)
+            else:
+                fallback_regex_idxs.append(i)
+        if alternatives == []:
+            # a pattern that never matches
+            alternatives.append("(?!)")
+        combined_regex = re.compile("|".join(alternatives))
   
-        return (regex_category_dict, limits_for_categories)
+        return (regex_category_dict, limits_for_categories, combined_regex, literal_automaton, 
+                fallback_regex_idxs)
 
 class BudgetAnalyzerApp(App):
     """
@@ -647,16 +932,24 @@ class BudgetAnalyzerApp(App):
 
         
         # Expense histories
+        # The accounts do not depend on each other, so they are parsed concurrently
 
-        graham_expenses = AccountExpenseHistory(data_path = graham_data, label = "Graham")
-        
-        eric_expenses = AccountExpenseHistory(data_path = eric_data, label = "Eric")
-        
-        john_expenses = AccountExpenseHistory(data_path = john_data, label = "John")
+        with ThreadPoolExecutor(max_workers = 5) as pool:
+            graham_future = pool.submit(AccountExpenseHistory, data_path = graham_data, label = "Graham")
+
+            eric_future = pool.submit(AccountExpenseHistory, data_path = eric_data, label = "Eric")
+
+            john_future = pool.submit(AccountExpenseHistory, data_path = john_data, label = "John")
+
+            michael_future = pool.submit(AccountExpenseHistory, data_path = michael_data, label = "Michael")
 
-        michael_expenses = AccountExpenseHistory(data_path = michael_data, label = "Michael")
+            terry_future = pool.submit(AccountExpenseHistory, data_path = terry_data, label = "Terry")
 
-        terry_expenses = AccountExpenseHistory(data_path = terry_data, label = "Terry")
+        graham_expenses  = graham_future.result()
+        eric_expenses    = eric_future.result()
+        john_expenses    = john_future.result()
+        michael_expenses = michael_future.result()
+        terry_expenses   = terry_future.result()
 
         account_tuple = (graham_expenses,
                          eric_expenses,